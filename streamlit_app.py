@@ -1,14 +1,33 @@
 # -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import bisect
+import functools
 import hashlib
+import heapq
 import hmac
+import math
 from pathlib import Path
 from typing import Dict, Any, List, Tuple, Optional
 
 import re
-import pandas as pd
-import numpy as np
 import streamlit as st
 
+# pandas/numpy はコールドスタートで数百msかかるため、ログイン前の描画では読み込まない。
+# ログイン通過後に _ensure_heavy_imports() でモジュール変数へ束縛する。
+pd = None
+np = None
+
+
+def _ensure_heavy_imports() -> None:
+    global pd, np
+    if pd is None:
+        import numpy
+        import pandas
+
+        pd = pandas
+        np = numpy
+
 
 APP_TITLE = "ディズニー混雑点数ナビ"
 SECRET_KEY_NAME = "APP_PASSPHRASE_HASH"
@@ -17,28 +36,23 @@ SECRET_KEY_NAME = "APP_PASSPHRASE_HASH"
 MODE_WAIT = "並ぶ"
 MODE_DPA = "DPA"
 MODE_PP = "PP"
+MODE_NONE = "採用しない"  # data_editor用（未選択）
+_MODE_POINT_KEYS = {MODE_WAIT: "points_wait", MODE_DPA: "points_dpa", MODE_PP: "points_pp"}
 # =========================
 # Normalization (matching CSV rows robustly)
 # =========================
-def norm_text(s: Any) -> str:
-    """Normalize strings for robust matching across CSVs.
-    - trims
-    - normalizes spaces
-    - removes various quote characters (CSV間で末尾の " が混ざりがち)
-    """
-    if s is None or (isinstance(s, float) and pd.isna(s)):
-        return ""
-    t = str(s).strip()
+# 全角スペース→半角 と 引用符の除去（CSV間で末尾の " が混ざりがち）を1パスで
+_NORM_TABLE = str.maketrans({"\u3000": " ", "“": None, "”": None, "＂": None, '"': None, "‘": None, "’": None, "'": None})
+_WS_RE = re.compile(r"\s+")
+_HOUR_RE = re.compile(r"(\d{1,2})")
 
-    # normalize full-width space -> half-width
-    t = t.replace("\u3000", " ")
 
-    # unify quotes then REMOVE them (they often differ between files)
-    for q in ["“", "”", "＂", '"', "‘", "’", "'"]:
-        t = t.replace(q, "")
+@functools.lru_cache(maxsize=4096)
+def _norm_text_cached(t: str) -> str:
+    t = t.strip().translate(_NORM_TABLE)
 
     # collapse repeated spaces
-    t = re.sub(r"\s+", " ", t).strip()
+    t = _WS_RE.sub(" ", t).strip()
 
     # remove trailing/leading punctuation that sometimes sticks to attraction names
     t = t.strip("・:：　-–—〜~()（）[]【】「」『』、。.,/")
@@ -46,21 +60,59 @@ def norm_text(s: Any) -> str:
     return t
 
 
+def norm_series(s: pd.Series) -> pd.Series:
+    """norm_text の列版。str アクセサでCループに落とす（行ごとの apply を置き換え）。"""
+    out = s.fillna("").astype(str).str.strip().str.translate(_NORM_TABLE)
+    out = out.str.replace(_WS_RE, " ", regex=True).str.strip()
+    return out.str.strip("・:：　-–—〜~()（）[]【】「」『』、。.,/")
+
+
+def norm_text(s: Any) -> str:
+    """Normalize strings for robust matching across CSVs.
+    - trims
+    - normalizes spaces
+    - removes various quote characters (CSV間で末尾の " が混ざりがち)
+
+    出てくる名前は少数の固定集合なので lru_cache で2回目以降は辞書引き1回。
+    """
+    if s is None or (isinstance(s, float) and pd.isna(s)):
+        return ""
+    return _norm_text_cached(str(s))
+
+
 # =========================
 # Auth
 # =========================
+@functools.lru_cache(maxsize=16)
 def sha256_hex(text: str) -> str:
     return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
 
+@st.cache_resource
+def _expected_hash() -> str:
+    """Secrets は読みに行くだけでもコストがある（Cloudではファイル読込）。1回だけ。"""
+    expected = st.secrets.get("PASSWORD_SHA256", "")
+    if not expected:
+        expected = st.secrets.get(SECRET_KEY_NAME, "")
+    # 比較のたびに str()+strip() し直さなくて済むよう、正規化した形で返す
+    return str(expected).strip()
+
+
+@st.cache_resource
+def _expected_digest() -> bytes:
+    """期待ハッシュ(hex)を一度だけ生バイト列へ。比較のたびの hex 往復をなくす。"""
+    try:
+        return bytes.fromhex(_expected_hash())
+    except ValueError:
+        # hex として不正な Secrets は「未設定」と同じ扱い
+        return b""
+
+
 def verify_passphrase(passphrase: str) -> bool:
-    expected = ""
     try:
-        expected = st.secrets.get("PASSWORD_SHA256", "")
-        if not expected:
-            expected = st.secrets.get(SECRET_KEY_NAME, "")
+        expected = _expected_digest()
     except Exception:
-        expected = ""
+        expected = b""
 
     if not expected:
         st.error(
@@ -73,11 +125,15 @@ def verify_passphrase(passphrase: str) -> bool:
         )
         return False
 
-    got = sha256_hex(passphrase.strip())
-    return hmac.compare_digest(got, str(expected).strip())
+    got = hashlib.sha256(passphrase.strip().encode("utf-8")).digest()
+    return hmac.compare_digest(got, expected)
 
 
 def login_gate() -> bool:
+    # ログイン済みなら widget も secrets も触らない（再実行ごとの定常コストをゼロに）
+    if st.session_state.get("auth_ok", False):
+        return True
+
     with st.sidebar:
         st.markdown("## 🔒 メンバー限定ログイン")
         passphrase = st.text_input("合言葉", type="password")
@@ -106,20 +162,46 @@ def _candidate_paths(filename: str) -> List[Path]:
     ]
 
 
-def read_csv_safely(filename: str) -> Optional[pd.DataFrame]:
+# filename → 解決済みパス。探索は3箇所の stat を伴うので、見つかった場所を覚えておく
+_resolved_paths: Dict[str, Path] = {}
+
+
+def _existing_path(filename: str) -> Optional[Path]:
+    p = _resolved_paths.get(filename)
+    if p is not None:
+        # 消された場合に備えて1回だけ確認（従来は毎回最大3回の stat）
+        if p.exists():
+            return p
+        del _resolved_paths[filename]
     for p in _candidate_paths(filename):
         if p.exists():
-            return pd.read_csv(p)
+            _resolved_paths[filename] = p
+            return p
+    # 見つからない場合はキャッシュしない（後からファイルが置かれたら拾いたい）
     return None
 
 
+def read_csv_safely(filename: str) -> Optional[pd.DataFrame]:
+    p = _existing_path(filename)
+    if p is None:
+        return None
+    return pd.read_csv(p)
+
+
 # =========================
 # About
 # =========================
+@st.cache_data
+def _load_about_text(path: str, mtime: float) -> str:
+    """説明文ファイルは mtime が変わった時だけ読み直す（毎回の syscall+decode を省く）"""
+    return Path(path).read_text(encoding="utf-8")
+
+
+@st.fragment
 def render_about():
     txt_path = Path(__file__).with_name("点数の考え方.txt")
     try:
-        body = txt_path.read_text(encoding="utf-8").strip()
+        body = _load_about_text(str(txt_path), txt_path.stat().st_mtime).strip()
         if not body:
             body = "（説明文ファイルは読み込めましたが、中身が空です）"
     except Exception:
@@ -132,32 +214,51 @@ def render_about():
 # =========================
 # Default points table
 # =========================
-@st.cache_data
+@st.cache_resource
+def _read_points_csv(path: str, mtime: float) -> pd.DataFrame:
+    """点数表CSVを読んで正規化。mtime をキーに含めるので、
+    ファイルが実際に変わった時だけ読み直し・数値化が走る。
+
+    cache_resource なのでプロセス内シングルトン（cache_data の呼び出しごとの
+    防御コピーが無い）。返り値は読み取り専用として扱い、書き換える側が copy する。
+    """
+    # pyarrow エンジンはマルチスレッドのトークナイザで日本語CSVでも速い。
+    # 無い/未対応の環境では C エンジン + mmap（read()コピーを省く）に落とす。
+    try:
+        df = pd.read_csv(path, engine="pyarrow")
+    except (ImportError, ValueError):
+        df = pd.read_csv(path, engine="c", memory_map=True, dtype={"park": str, "attraction": str})
+
+    # 使う列だけ残す（知らない列に後段の処理コストを払わない）
+    df = df[[c for c in df.columns if c in {"park", "attraction", "wait", "dpa", "pp", "duration"}]]
+    num_cols = [c for c in ["wait", "dpa", "pp", "duration"] if c in df.columns]
+    if num_cols:
+        df[num_cols] = df[num_cols].apply(pd.to_numeric, errors="coerce")
+    if "park" in df.columns:
+        df["park"] = df["park"].astype(str).str.strip()
+    if "attraction" in df.columns:
+        df["attraction"] = df["attraction"].astype(str).str.strip()
+    if "park" in df.columns:
+        # 取りうる値は TDL/TDS 程度。category にして int8 コード比較・省メモリに
+        df["park"] = df["park"].astype("category")
+    if "park" in df.columns and "attraction" in df.columns:
+        # category 化の後なら park 側の重複判定は int8 コードのハッシュで済む
+        df = df[~df.duplicated(subset=["park", "attraction"], keep="first")].reset_index(drop=True)
+    if "pp" not in df.columns:
+        df["pp"] = pd.NA
+    if "duration" not in df.columns:
+        df["duration"] = pd.NA
+    return df
+
+
 def load_default_attractions_points() -> pd.DataFrame:
     """
     attractions_master.csv（点数表）
     列想定：park, attraction, wait, dpa, pp, duration
     """
-    import os
-
-    if os.path.exists("attractions_master.csv"):
-        df = pd.read_csv("attractions_master.csv")
-        for c in ["wait", "dpa", "pp", "duration"]:
-            if c in df.columns:
-                df[c] = pd.to_numeric(df[c], errors="coerce")
-        if "park" in df.columns:
-            df["park"] = df["park"].astype(str).str.strip()
-        if "attraction" in df.columns:
-            df["attraction"] = df["attraction"].astype(str).str.strip()
-        if "park" in df.columns and "attraction" in df.columns:
-            df = df.drop_duplicates(subset=["park", "attraction"], keep="first").reset_index(drop=True)
-        if "pp" not in df.columns:
-            df["pp"] = pd.NA
-        if "duration" not in df.columns:
-            df["duration"] = pd.NA
-        if "duration" not in df.columns:
-            df["duration"] = pd.NA
-        return df
+    for p in _candidate_paths("attractions_master.csv"):
+        if p.exists():
+            return _read_points_csv(str(p), p.stat().st_mtime)
 
     # fallback
     return pd.DataFrame(
@@ -172,6 +273,61 @@ def load_default_attractions_points() -> pd.DataFrame:
     )
 
 
+def points_sig(df: pd.DataFrame) -> int:
+    """点数表の変更検知用フィンガープリント。
+    全セルの equals 比較の代わりに、ベクトル化された1パスのハッシュで済ませる。
+    """
+    return int(pd.util.hash_pandas_object(df, index=False).sum())
+
+
+@st.cache_data
+def _park_row_positions(sig: int, _df: pd.DataFrame):
+    """パーク名 → 行位置配列。点数表の sig が変わった時だけブール比較をやり直す。"""
+    parks = _df["park"].astype(str).to_numpy()
+    return {park: np.flatnonzero(parks == park) for park in ("TDL", "TDS")}
+
+
+@st.cache_data
+def _view_row_keys(sig: int, park_filter: str, _df_view: pd.DataFrame) -> Tuple[str, ...]:
+    """表示中ビューの row_key 列。sig とフィルタが変わらない間は文字列連結をやり直さない。"""
+    keys = _df_view["park"].astype(str).str.strip() + "__" + _df_view["attraction"].astype(str).str.strip()
+    return tuple(keys)
+
+
+@st.cache_data
+def _points_csv_bytes(sig: int, _df: pd.DataFrame) -> bytes:
+    """ダウンロード用CSVバイト列。sig が変わった時だけ直列化し直す
+    （_df は先頭アンダースコアで Streamlit のハッシュ対象から外す）。
+    """
+    return _df.to_csv(index=False).encode("utf-8-sig")
+
+
+def coerce_points_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """wait/dpa/pp/duration を数値化した作業用フレームを返す（無い列は追加）。
+    LEFT/RIGHT 両カラムで使い回す想定（再実行ごとに2回組み立てない）。
+    """
+    # 列単位の差し替えしかしないので deep copy は不要（列代入はコピー側だけ付け替わる）
+    df = df.copy(deep=False)
+    for c in ["wait", "dpa", "pp", "duration"]:
+        if c not in df.columns:
+            df[c] = np.nan
+        elif not pd.api.types.is_numeric_dtype(df[c]):
+            # 読込/アップロード/編集書き戻しの各経路で数値化済みなので、通常は素通り
+            df[c] = pd.to_numeric(df[c], errors="coerce")
+    df["wait"] = df["wait"].fillna(0.0)
+    return df
+
+
+@st.cache_resource(show_spinner=False)
+def _coerced_points(sig: int, _df: pd.DataFrame) -> pd.DataFrame:
+    """coerce_points_columns の結果を点数表シグネチャ単位で使い回す。
+    表が変わらない限り再実行ごとの copy/fillna すら走らない。
+    cache_resource（共有参照）なので呼び出し側は読み取り専用で扱うこと。
+    ※ selected_to_plans が _park_norm/_attr_norm を書き足すのは意図通り
+    （同じ表に対する正規化列が再実行をまたいで残る）。"""
+    return coerce_points_columns(_df)
+
+
 # =========================
 # Crowd options (user-defined)
 # =========================
@@ -200,8 +356,17 @@ CROWD_PERIOD_OPTIONS = [
 CROWD_STARS_BY_PERIOD = {label: label.count("★") for label in CROWD_PERIOD_OPTIONS}
 
 
+# 係数テーブル（呼び出しごとに dict を作り直さない。再実行のたび複数回呼ばれる）
+_WAIT_TOL_FACTOR = {"30分まで": 1.00, "60分まで": 1.25, "90分まで": 1.45}
+_CROWD_LIMIT_30MIN = {1: 12.0, 2: 9.0, 3: 6.0}
+_CROWD_SPEED = {3: 1.00, 2: 0.90, 1: 0.80}
+
+# build_schedule のタイムライン列（行タプルの並び順と対応）
+_TIMELINE_COLUMNS = ["列開始", "開始", "終了", "パーク", "アトラクション", "手段", "メモ"]
+
+
 def wait_tolerance_factor(wait_tolerance: str) -> float:
-    return {"30分まで": 1.00, "60分まで": 1.25, "90分まで": 1.45}[wait_tolerance]
+    return _WAIT_TOL_FACTOR[wait_tolerance]
 
 
 def perk_modifier(happy_entry: bool) -> float:
@@ -212,24 +377,33 @@ def perk_modifier(happy_entry: bool) -> float:
 
 
 def crowd_limit_30min_from_stars(stars: int) -> float:
-    base = {1: 12.0, 2: 9.0, 3: 6.0}
-    return base.get(stars, 9.0)
+    return _CROWD_LIMIT_30MIN.get(stars, 9.0)
+
 
+# (星, 待ち許容, ハッピーエントリー) → 上限点。組合せは高々 3×3×2 なので全部先に掛けておく
+_LIMIT_TABLE = {
+    (stars, tol, happy): base * tol_f * (1.15 if happy else 1.00)
+    for stars, base in _CROWD_LIMIT_30MIN.items()
+    for tol, tol_f in _WAIT_TOL_FACTOR.items()
+    for happy in (False, True)
+}
 
+
+# 評価文はテンプレを毎回組み立てず、しきい値→文言の固定テーブルから引く
+_EVAL_THRESHOLDS = (0.75, 1.00, 1.25)
+_EVAL_VERDICTS = (
+    ("かなりラク（余白あり）", "待ち許容内に収めやすい構成です。ショー/休憩/偶然の寄り道も入れやすい。"),
+    ("だいたいOK（計画通りなら成立）", "目安上限付近です。開園待ち・移動・食事の段取り次第で体感が変わります。"),
+    ("けっこう大変（待ち・妥協が出やすい）", "どこかで待ち時間超過 or 予定変更が起きやすいです。『捨てる候補』を先に決めるのが安全。"),
+    ("無理寄り（超・計画職人向け）", "この条件だと、待ち許容内を維持するのはかなり厳しめ。DPA/入園アドバンテージ前提に。"),
+)
+
+
+@functools.lru_cache(maxsize=128)
 def evaluate(total_points: float, limit: float) -> Dict[str, Any]:
+    # 返り値の dict は呼び出し側で読み取り専用（キャッシュ共有されるので書き換えない）
     ratio = total_points / limit if limit > 0 else 999
-    if ratio <= 0.75:
-        label = "かなりラク（余白あり）"
-        msg = "待ち許容内に収めやすい構成です。ショー/休憩/偶然の寄り道も入れやすい。"
-    elif ratio <= 1.00:
-        label = "だいたいOK（計画通りなら成立）"
-        msg = "目安上限付近です。開園待ち・移動・食事の段取り次第で体感が変わります。"
-    elif ratio <= 1.25:
-        label = "けっこう大変（待ち・妥協が出やすい）"
-        msg = "どこかで待ち時間超過 or 予定変更が起きやすいです。『捨てる候補』を先に決めるのが安全。"
-    else:
-        label = "無理寄り（超・計画職人向け）"
-        msg = "この条件だと、待ち許容内を維持するのはかなり厳しめ。DPA/入園アドバンテージ前提に。"
+    label, msg = _EVAL_VERDICTS[bisect.bisect_left(_EVAL_THRESHOLDS, ratio)]
     return {"limit": float(limit), "ratio": ratio, "label": label, "message": msg}
 
 
@@ -247,39 +421,51 @@ def _row_id(park: str, attraction: str) -> str:
     return f"{park}__{attraction}"
 
 
-def toggle_select(row_key: str, mode: str):
-    cur = st.session_state["selected"].get(row_key)
-    if cur == mode:
-        st.session_state["selected"].pop(row_key, None)
-    else:
-        st.session_state["selected"][row_key] = mode
-
-
 def clear_all_selections():
     st.session_state["selected"] = {}
     st.session_state["confirmed"] = False
     st.session_state["plan_confirmed"] = False
+    # data_editor（選択列）のウィジェット状態も破棄しないと旧選択が書き戻されてしまう
+    for k in [k for k in st.session_state.keys() if str(k).startswith("picker_")]:
+        del st.session_state[k]
 
 
 # =========================
 # Convert selected -> plans
 # =========================
-def selected_to_plans(df_points: pd.DataFrame, selected: Dict[str, str]) -> List[Dict[str, Any]]:
+@st.cache_data
+def _points_index_map(sig: int, _df: pd.DataFrame) -> Dict[Tuple[str, str], int]:
+    """(park, attraction)（正規化済み）→ 行位置。点数表の sig が変わった時だけ作り直す。
+    正規化後にキーが衝突した場合は最初の行を採用。
+    """
+    lookup: Dict[Tuple[str, str], int] = {}
+    for i, key in enumerate(zip(_df["_park_norm"], _df["_attr_norm"])):
+        lookup.setdefault(key, i)
+    return lookup
+
+
+def selected_to_plans(df_points: pd.DataFrame, selected: Dict[str, str], sig: Optional[int] = None) -> List[Dict[str, Any]]:
     plans: List[Dict[str, Any]] = []
     # add normalized columns for robust matching
     if "_park_norm" not in df_points.columns:
-        df_points["_park_norm"] = df_points["park"].apply(norm_text)
+        df_points["_park_norm"] = norm_series(df_points["park"])
     if "_attr_norm" not in df_points.columns:
-        df_points["_attr_norm"] = df_points["attraction"].apply(norm_text)
+        df_points["_attr_norm"] = norm_series(df_points["attraction"])
+    if sig is not None:
+        lookup = _points_index_map(sig, df_points)
+    else:
+        lookup = {}
+        for i, key in enumerate(zip(df_points["_park_norm"], df_points["_attr_norm"])):
+            lookup.setdefault(key, i)
     for row_key, mode in selected.items():
         try:
             park, name = row_key.split("__", 1)
         except ValueError:
             continue
-        match = df_points[(df_points["_park_norm"] == norm_text(park)) & (df_points["_attr_norm"] == norm_text(name))]
-        if match.empty:
+        idx = lookup.get((norm_text(park), norm_text(name)))
+        if idx is None:
             continue
-        r = match.iloc[0]
+        r = df_points.iloc[idx]
         plans.append(
             {
                 "park": park,
@@ -288,7 +474,6 @@ def selected_to_plans(df_points: pd.DataFrame, selected: Dict[str, str]) -> List
                 "points_wait": float(r["wait"]) if pd.notna(r.get("wait", pd.NA)) else 0.0,
                 "points_dpa": float(r["dpa"]) if pd.notna(r.get("dpa", pd.NA)) else None,
                 "points_pp": float(r["pp"]) if pd.notna(r.get("pp", pd.NA)) else None,
-                "duration": float(r.get("duration", 10.0)) if pd.notna(r.get("duration", pd.NA)) else 10.0,
                 "duration": float(r["duration"]) if pd.notna(r.get("duration", pd.NA)) else 10.0,
             }
         )
@@ -303,36 +488,41 @@ def _parse_hour_columns(cols: List[str]) -> List[int]:
     wait CSV想定: hour_09, hour_10 ... hour_21
     ただしテンプレの列名が崩れても末尾の数字から拾えるようにする
     """
-    hours = []
+    hours = set()
     for c in cols:
         if c.startswith("hour_"):
-            import re
-
-            m = re.findall(r"(\d{1,2})", c)
-            if m:
+            suf = c[5:]
+            if suf.isdigit():
+                # 通常ケース（hour_09 / hour_9）は正規表現なしで拾う
+                h = int(suf)
+            else:
+                m = _HOUR_RE.findall(c)
+                if not m:
+                    continue
                 h = int(m[-1])
-                if 0 <= h <= 23:
-                    hours.append(h)
-    hours = sorted(list(set(hours)))
-    return [h for h in hours if 9 <= h <= 21]
-
+            if 0 <= h <= 23:
+                hours.add(h)
+    return sorted(h for h in hours if 9 <= h <= 21)
 
-def load_wait_table_minutes(dataset_id: str) -> pd.DataFrame:
-    """
-    wait_{dataset_id}.csv
-    columns: park, attraction, hour_09..hour_21 (minutes)
-    """
-    fn = f"wait_{dataset_id}.csv"
-    df = read_csv_safely(fn)
-    if df is None:
-        return pd.DataFrame(columns=["park", "attraction"])
 
-    # normalize
+def _add_norm_cols(df: pd.DataFrame) -> None:
+    """park/attraction を strip し、マッチング用の _park_norm/_attr_norm 列を足す。
+    3つのデータセットローダー共通（キャッシュ済みボディの中から呼ばれる想定）。"""
     for c in ["park", "attraction"]:
         if c in df.columns:
             df[c] = df[c].astype(str).str.strip()
-    df["_park_norm"] = df["park"].apply(norm_text)
-    df["_attr_norm"] = df["attraction"].apply(norm_text)
+    df["_park_norm"] = norm_series(df["park"])
+    df["_attr_norm"] = norm_series(df["attraction"])
+
+
+@st.cache_resource(show_spinner=False)
+def _load_wait_table_cached(path: str, mtime: float) -> pd.DataFrame:
+    """wait CSV の読み込み＋正規化。mtime キーなのでファイルが変わった時だけ走る。
+    点数表ローダーと同じく共有シングルトン（返り値は読み取り専用扱い）。"""
+    df = pd.read_csv(path)
+
+    # normalize
+    _add_norm_cols(df)
 
     hour_cols = _parse_hour_columns(list(df.columns))
     # numeric
@@ -353,21 +543,31 @@ def load_wait_table_minutes(dataset_id: str) -> pd.DataFrame:
     return df
 
 
-def load_sellout_table(dataset_id: str) -> pd.DataFrame:
+@st.cache_resource(show_spinner=False)
+def _empty_table(columns: Tuple[str, ...]) -> pd.DataFrame:
+    """CSV欠損時の共有空フレーム。毎回 new すると id() がすぐ再利用されて
+    _cached_build_schedule の frames_key（フレームの id ベース）が衝突しうるので、
+    読み込み済みフレームと同じく寿命の長いシングルトンにしておく。"""
+    return pd.DataFrame(columns=list(columns))
+
+
+def load_wait_table_minutes(dataset_id: str) -> pd.DataFrame:
     """
-    sellout_{dataset_id}.csv
-    columns: park, attraction, dpa_sellout_hour, pp_sellout_hour
+    wait_{dataset_id}.csv
+    columns: park, attraction, hour_09..hour_21 (minutes)
     """
-    fn = f"sellout_{dataset_id}.csv"
-    df = read_csv_safely(fn)
-    if df is None:
-        return pd.DataFrame(columns=["park", "attraction", "dpa_sellout_hour", "pp_sellout_hour"])
+    p = _existing_path(f"wait_{dataset_id}.csv")
+    if p is None:
+        return _empty_table(("park", "attraction"))
+    return _load_wait_table_cached(str(p), p.stat().st_mtime)
 
-    for c in ["park", "attraction"]:
-        if c in df.columns:
-            df[c] = df[c].astype(str).str.strip()
-    df["_park_norm"] = df["park"].apply(norm_text)
-    df["_attr_norm"] = df["attraction"].apply(norm_text)
+
+@st.cache_resource(show_spinner=False)
+def _load_sellout_table_cached(path: str, mtime: float) -> pd.DataFrame:
+    """sellout CSV の読み込み＋正規化（mtime キー、共有シングルトン）"""
+    df = pd.read_csv(path)
+
+    _add_norm_cols(df)
 
     for c in ["dpa_sellout_hour", "pp_sellout_hour"]:
         if c in df.columns:
@@ -376,24 +576,23 @@ def load_sellout_table(dataset_id: str) -> pd.DataFrame:
     return df
 
 
-def load_factor_table(dataset_id: str) -> pd.DataFrame:
+def load_sellout_table(dataset_id: str) -> pd.DataFrame:
     """
-    factor_{dataset_id}.csv
-    columns (expected):
-      park, attraction,
-      dpa_sellout_speed, pp_sellout_speed,
-      wait_multiplier_morning, wait_multiplier_noon, wait_multiplier_evening
+    sellout_{dataset_id}.csv
+    columns: park, attraction, dpa_sellout_hour, pp_sellout_hour
     """
-    fn = f"factor_{dataset_id}.csv"
-    df = read_csv_safely(fn)
-    if df is None:
-        return pd.DataFrame(columns=["park", "attraction"])
+    p = _existing_path(f"sellout_{dataset_id}.csv")
+    if p is None:
+        return _empty_table(("park", "attraction", "dpa_sellout_hour", "pp_sellout_hour"))
+    return _load_sellout_table_cached(str(p), p.stat().st_mtime)
 
-    for c in ["park", "attraction"]:
-        if c in df.columns:
-            df[c] = df[c].astype(str).str.strip()
-    df["_park_norm"] = df["park"].apply(norm_text)
-    df["_attr_norm"] = df["attraction"].apply(norm_text)
+
+@st.cache_resource(show_spinner=False)
+def _load_factor_table_cached(path: str, mtime: float) -> pd.DataFrame:
+    """factor CSV の読み込み＋正規化（mtime キー、共有シングルトン）"""
+    df = pd.read_csv(path)
+
+    _add_norm_cols(df)
 
     # best-effort: numeric conversions for known-ish columns
     for c in df.columns:
@@ -403,6 +602,76 @@ def load_factor_table(dataset_id: str) -> pd.DataFrame:
     return df
 
 
+def load_factor_table(dataset_id: str) -> pd.DataFrame:
+    """
+    factor_{dataset_id}.csv
+    columns (expected):
+      park, attraction,
+      dpa_sellout_speed, pp_sellout_speed,
+      wait_multiplier_morning, wait_multiplier_noon, wait_multiplier_evening
+    """
+    p = _existing_path(f"factor_{dataset_id}.csv")
+    if p is None:
+        return _empty_table(("park", "attraction"))
+    return _load_factor_table_cached(str(p), p.stat().st_mtime)
+
+
+def _norm_row_lookup(df: pd.DataFrame) -> Dict[Tuple[str, str], int]:
+    """(park, attraction) の正規化キー → 行位置。
+    ローダーが返す共有フレームの attrs に載せて使い回す（ファイルが変われば
+    フレームごと別オブジェクトになるので古い索引は残らない）。重複キーは
+    先勝ち（従来の iloc[0] と同じ）。"""
+    lookup = df.attrs.get("_norm_lookup")
+    if lookup is None:
+        if "_park_norm" in df.columns:
+            parks = df["_park_norm"]
+        else:
+            parks = df["park"].astype(str).str.strip()
+        if "_attr_norm" in df.columns:
+            attrs = df["_attr_norm"]
+        else:
+            attrs = df["attraction"].astype(str).str.strip()
+        lookup = {}
+        for i, key in enumerate(zip(parks, attrs)):
+            lookup.setdefault(key, i)
+        df.attrs["_norm_lookup"] = lookup
+    return lookup
+
+
+# 係数のデフォルト（factor CSV に行/列が無い時）
+_WAIT_MULT_DEFAULTS = (1.00, 1.15, 0.90)  # morning / noon / evening
+
+
+def _factor_tables(df_factor: pd.DataFrame):
+    """factor フレームから (時間帯係数の行列, モード別売切れ速度配列) を前計算。
+    列名の部分一致・NaN埋めをここで済ませ、参照側は配列インデックスだけにする。
+    _wait_matrix と同じく共有フレームの attrs に載せて使い回す。"""
+    tables = df_factor.attrs.get("_factor_tables")
+    if tables is None:
+        n = len(df_factor)
+        prefixes = ("wait_multiplier_morning", "wait_multiplier_noon", "wait_multiplier_evening")
+        mult = np.empty((n, 3))
+        for j, (prefix, default) in enumerate(zip(prefixes, _WAIT_MULT_DEFAULTS)):
+            # 欲しい列名が崩れてても拾えるように、部分一致で探す
+            cols = [c for c in df_factor.columns if c.startswith(prefix)]
+            if cols:
+                v = pd.to_numeric(df_factor[cols[0]], errors="coerce").to_numpy(dtype=float)
+                mult[:, j] = np.where(np.isnan(v), default, v)
+            else:
+                mult[:, j] = default
+        speed = {}
+        for mode, token in ((MODE_DPA, "dpa_sellout_speed"), (MODE_PP, "pp_sellout_speed")):
+            cols = [c for c in df_factor.columns if token in c]
+            if cols:
+                v = pd.to_numeric(df_factor[cols[0]], errors="coerce").to_numpy(dtype=float)
+                speed[mode] = np.where(np.isnan(v), 1.0, v)
+            else:
+                speed[mode] = np.full(n, 1.0)
+        tables = (mult, speed)
+        df_factor.attrs["_factor_tables"] = tables
+    return tables
+
+
 def factor_wait_multiplier(df_factor: pd.DataFrame, park: str, attraction: str, hour: int) -> float:
     """
     morning/noon/evening の簡易係数
@@ -410,32 +679,18 @@ def factor_wait_multiplier(df_factor: pd.DataFrame, park: str, attraction: str,
     noon: 12-17
     evening: 18-21
     """
-    # defaults
-    wm = 1.00
-    wn = 1.15
-    we = 0.90
+    wm, wn, we = _WAIT_MULT_DEFAULTS
 
     if not df_factor.empty:
-        m = df_factor[(df_factor.get("_park_norm", df_factor["park"].astype(str).str.strip()) == norm_text(park)) & (df_factor.get("_attr_norm", df_factor["attraction"].astype(str).str.strip()) == norm_text(attraction))]
-        if not m.empty:
-            r = m.iloc[0]
-            # 欲しい列名が崩れてても拾えるように、部分一致で探す
-            def pick(prefix: str, default: float) -> float:
-                cols = [c for c in df_factor.columns if c.startswith(prefix)]
-                if cols:
-                    v = r.get(cols[0], default)
-                    return float(v) if pd.notna(v) else default
-                return default
-
-            wm = pick("wait_multiplier_morning", wm)
-            wn = pick("wait_multiplier_noon", wn)
-            we = pick("wait_multiplier_evening", we)
+        pos = _norm_row_lookup(df_factor).get((norm_text(park), norm_text(attraction)))
+        if pos is not None:
+            wm, wn, we = _factor_tables(df_factor)[0][pos]
 
     if 9 <= hour <= 11:
-        return wm
+        return float(wm)
     if 12 <= hour <= 17:
-        return wn
-    return we
+        return float(wn)
+    return float(we)
 
 
 def factor_sellout_speed(df_factor: pd.DataFrame, park: str, attraction: str, mode: str) -> float:
@@ -443,23 +698,40 @@ def factor_sellout_speed(df_factor: pd.DataFrame, park: str, attraction: str, mo
     混雑★★★ほど早く枠が消える、等の「なくなり速度係数」
     DPA/PPで係数列を分ける想定。無ければ1.0
     """
-    if df_factor.empty:
+    if df_factor.empty or mode not in (MODE_DPA, MODE_PP):
         return 1.00
-    m = df_factor[(df_factor.get("_park_norm", df_factor["park"].astype(str).str.strip()) == norm_text(park)) & (df_factor.get("_attr_norm", df_factor["attraction"].astype(str).str.strip()) == norm_text(attraction))]
-    if m.empty:
+    pos = _norm_row_lookup(df_factor).get((norm_text(park), norm_text(attraction)))
+    if pos is None:
         return 1.00
-    r = m.iloc[0]
-    if mode == MODE_DPA:
-        cols = [c for c in df_factor.columns if "dpa_sellout_speed" in c]
-        if cols:
-            v = r.get(cols[0], 1.0)
-            return float(v) if pd.notna(v) else 1.0
-    if mode == MODE_PP:
-        cols = [c for c in df_factor.columns if "pp_sellout_speed" in c]
-        if cols:
-            v = r.get(cols[0], 1.0)
-            return float(v) if pd.notna(v) else 1.0
-    return 1.00
+    return float(_factor_tables(df_factor)[1][mode][pos])
+
+
+def _hour_column(df_wait: pd.DataFrame, hour: int) -> Optional[str]:
+    """hour に対応する列名を探す（hour_09 / hour_9 / 崩れた名前の順）"""
+    if f"hour_{hour:02d}" in df_wait.columns:
+        return f"hour_{hour:02d}"
+    if f"hour_{hour}" in df_wait.columns:
+        return f"hour_{hour}"
+    for c in df_wait.columns:
+        if c.startswith("hour_") and c[5:].isdigit() and int(c[5:]) == int(hour):
+            return c
+    return None
+
+
+def _wait_matrix(df_wait: pd.DataFrame):
+    """(行, 時間0..23) の密 float 行列。欠損・列なしは fallback の 30.0 で埋める。
+    列名解決と NaN 判定を前計算しておき、参照側は配列インデックス2回にする。
+    _norm_row_lookup と同じく共有フレームの attrs に載せて使い回す。"""
+    mat = df_wait.attrs.get("_wait_matrix")
+    if mat is None:
+        mat = np.full((len(df_wait), 24), 30.0)
+        for h in range(24):
+            col = _hour_column(df_wait, h)
+            if col is not None:
+                v = pd.to_numeric(df_wait[col], errors="coerce").to_numpy(dtype=float)
+                mat[:, h] = np.where(np.isnan(v), 30.0, v)
+        df_wait.attrs["_wait_matrix"] = mat
+    return mat
 
 
 def get_wait_minutes(df_wait: pd.DataFrame, park: str, attraction: str, hour: int) -> float:
@@ -468,31 +740,12 @@ def get_wait_minutes(df_wait: pd.DataFrame, park: str, attraction: str, hour: in
     """
     if df_wait.empty:
         return 30.0  # fallback
-    m = df_wait[(df_wait.get("_park_norm", df_wait["park"].astype(str).str.strip()) == norm_text(park)) & (df_wait.get("_attr_norm", df_wait["attraction"].astype(str).str.strip()) == norm_text(attraction))]
-    if m.empty:
-        return 30.0
-    r = m.iloc[0]
-
-    # find a column for this hour (strict)
-    col = None
-    if f"hour_{hour:02d}" in df_wait.columns:
-        col = f"hour_{hour:02d}"
-    elif f"hour_{hour}" in df_wait.columns:
-        col = f"hour_{hour}"
-    else:
-        for c in df_wait.columns:
-            if c.startswith("hour_") and c[5:].isdigit() and int(c[5:]) == int(hour):
-                col = c
-                break
-
-    if col is None:
-        return 30.0
-
-    v = r.get(col, 30.0)
-    try:
-        return float(v) if pd.notna(v) else 30.0
-    except Exception:
+    pos = _norm_row_lookup(df_wait).get((norm_text(park), norm_text(attraction)))
+    if pos is None:
         return 30.0
+    if 0 <= hour <= 23:
+        return float(_wait_matrix(df_wait)[pos, hour])
+    return 30.0
 
 
 def get_sellout_hour(df_sellout: pd.DataFrame, park: str, attraction: str, mode: str) -> Optional[int]:
@@ -501,10 +754,10 @@ def get_sellout_hour(df_sellout: pd.DataFrame, park: str, attraction: str, mode:
     """
     if df_sellout.empty:
         return None
-    m = df_sellout[(df_sellout.get("_park_norm", df_sellout["park"].astype(str).str.strip()) == norm_text(park)) & (df_sellout.get("_attr_norm", df_sellout["attraction"].astype(str).str.strip()) == norm_text(attraction))]
-    if m.empty:
+    pos = _norm_row_lookup(df_sellout).get((norm_text(park), norm_text(attraction)))
+    if pos is None:
         return None
-    r = m.iloc[0]
+    r = df_sellout.iloc[pos]
     col = "dpa_sellout_hour" if mode == MODE_DPA else "pp_sellout_hour"
     if col not in df_sellout.columns:
         return None
@@ -520,10 +773,15 @@ def get_sellout_hour(df_sellout: pd.DataFrame, park: str, attraction: str, mode:
 # =========================
 # Simple simulation (skeleton, but executable)
 # =========================
+# 1日分の "HH:MM" 文字列を先に作っておく（スケジューラはイベントごとに2回呼ぶ）
+_HHMM = tuple(f"{total // 60:02d}:{total % 60:02d}" for total in range(24 * 60))
+
+
 def minutes_to_hhmm(min_from_open: int, open_hour: int = 9) -> str:
     total = open_hour * 60 + min_from_open
-    h = total // 60
-    m = total % 60
+    if 0 <= total < len(_HHMM):
+        return _HHMM[total]
+    h, m = divmod(total, 60)
     return f"{h:02d}:{m:02d}"
 
 
@@ -554,31 +812,57 @@ def build_schedule(
     T_OPEN = 0
     T_CLOSE = (close_hour - open_hour) * 60
 
+    # helper: crowd affects sellout "effective hour"
+    # ★★★ほど早く消える：stars=3 を基準に、starsが少ないほど遅くなる（ゆるい補正）
+    # 例: ★★★: 1.00, ★★: 0.90, ★: 0.80
+    crowd_speed = _CROWD_SPEED.get(crowd_stars, 0.90)
+
     # internal state
+    # 売切れ時刻・速度係数はタスクごとに不変なので、ループ内で引き直さずここで1回だけ解決する
     tasks = []
     for p in plans:
+        sellout_hour = get_sellout_hour(df_sellout, p["park"], p["attraction"], p["mode"])
+        sellout_speed = factor_sellout_speed(df_factor, p["park"], p["attraction"], p["mode"])
+        if sellout_hour is None:
+            sellout_hour_eff = None
+        else:
+            # 混雑と係数で売切れが早まる（簡易）
+            sellout_hour_eff = int(round(sellout_hour / max(0.2, crowd_speed * sellout_speed)))
+        # 所要分・待ち上書きもここで素の int/float に落としておく
+        # （do_wait/do_booked が呼ばれるたびに pd.isna + int(round()) し直さない）
+        dur = float(p.get("duration", 10.0)) if pd.notna(p.get("duration", pd.NA)) else 10.0
+        duration_min = 10 if (not math.isfinite(dur) or dur <= 0) else int(round(dur))
+        try:
+            wait_override = float(p.get("wait_override_min", math.nan))
+        except (TypeError, ValueError):
+            wait_override = math.nan
         tasks.append(
             {
                 "park": p["park"],
                 "attraction": p["attraction"],
                 "mode": p["mode"],
-                "duration": float(p.get("duration", 10.0)) if p.get("duration", None) is not None else 10.0,
                 "status": "todo",       # todo/booked/done
                 "return_min": None,     # for DPA/PP
-                "duration": float(p.get("duration", 10.0)) if pd.notna(p.get("duration", pd.NA)) else 10.0,
-                "wait_override_min": p.get("wait_override_min", float("nan")),
+                "duration": dur,
+                "duration_min": duration_min,
+                "wait_override_min": wait_override,
+                "sellout_hour": sellout_hour,
+                "sellout_speed": sellout_speed,
+                "sellout_hour_eff": sellout_hour_eff,
+                "seq": len(tasks),  # 予約ヒープの同時刻タイブレーク用（従来の先頭優先と同じ）
             }
         )
 
+    # 未処理タスクはモード別リストで持つ（毎ターン tasks 全体を status/mode でなめ直さない）。
+    # 消化済み・予約済みになったらリストから外す（各タスク高々1回）
+    todo_by_mode: Dict[str, List[Dict[str, Any]]] = {MODE_WAIT: [], MODE_DPA: [], MODE_PP: []}
+    for task in tasks:
+        todo_by_mode.setdefault(task["mode"], []).append(task)
+
     # rights
     next_dpa_buy_min = 0
     next_pp_get_min = 0
 
-    # helper: crowd affects sellout "effective hour"
-    # ★★★ほど早く消える：stars=3 を基準に、starsが少ないほど遅くなる（ゆるい補正）
-    # 例: ★★★: 1.00, ★★: 0.90, ★: 0.80
-    crowd_speed = {3: 1.00, 2: 0.90, 1: 0.80}.get(crowd_stars, 0.90)
-
     timeline = []
     t = 0
 
@@ -595,39 +879,32 @@ def build_schedule(
         """
         ride_end_min = min(ride_start_min + dur_min, T_CLOSE)
 
-        row = {
-            "列開始": minutes_to_hhmm(queue_start_min, open_hour) if queue_start_min is not None else "",
-            "開始": minutes_to_hhmm(ride_start_min, open_hour),
-            "終了": minutes_to_hhmm(ride_end_min, open_hour),
-            "パーク": task["park"],
-            "アトラクション": task["attraction"],
-            "手段": task["mode"],
-            "メモ": note,
-        }
-        timeline.append(row)
+        # 行は _TIMELINE_COLUMNS 順のタプル（DataFrame 化は最後に1回だけ）
+        timeline.append(
+            (
+                minutes_to_hhmm(queue_start_min, open_hour) if queue_start_min is not None else "",
+                minutes_to_hhmm(ride_start_min, open_hour),
+                minutes_to_hhmm(ride_end_min, open_hour),
+                task["park"],
+                task["attraction"],
+                task["mode"],
+                note,
+            )
+        )
         return ride_end_min
-        return end_min
-
-    def find_booked_ready(now_min: int) -> Optional[int]:
-        idx = None
-        best_return = 10**9
-        for i, task in enumerate(tasks):
-            if task["status"] == "booked" and task["return_min"] is not None and task["return_min"] <= now_min:
-                if task["return_min"] < best_return:
-                    best_return = task["return_min"]
-                    idx = i
-        return idx
+
+    # 予約済みタスクは (戻り時刻, seq) の最小ヒープで持つ（毎ターンの全走査をやめる）
+    booked_heap: List[Tuple[int, int, Dict[str, Any]]] = []
+
+    def find_booked_ready(now_min: int) -> Optional[Dict[str, Any]]:
+        if booked_heap and booked_heap[0][0] <= now_min:
+            return heapq.heappop(booked_heap)[2]
+        return None
 
     def earliest_possible_return_min(task: Dict[str, Any], now_min: int) -> Optional[int]:
         now_hour = hour_from_min(now_min, open_hour)
-        sellout_hour_raw = get_sellout_hour(df_sellout, task["park"], task["attraction"], task["mode"])
-        sp = factor_sellout_speed(df_factor, task["park"], task["attraction"], task["mode"])
-        # effective sellout hour (smaller => earlier sellout)
-        if sellout_hour_raw is None:
-            sellout_hour_eff = None
-        else:
-            # 混雑と係数で売切れが早まる（簡易）
-            sellout_hour_eff = int(round(sellout_hour_raw / max(0.2, crowd_speed * sp)))
+        # effective sellout hour (smaller => earlier sellout)：タスク生成時に前計算済み
+        sellout_hour_eff = task["sellout_hour_eff"]
 
         # if sold out already
         if sellout_hour_eff is not None and now_hour >= sellout_hour_eff:
@@ -655,20 +932,21 @@ def build_schedule(
         nonlocal next_dpa_buy_min, next_pp_get_min
 
         # pick a task to book: earliest sellout / fastest speed
-        candidates = [task for task in tasks if task["status"] == "todo" and task["mode"] == mode]
+        candidates = todo_by_mode.get(mode, [])
         if not candidates:
             return None
 
         # scoring: smaller sellout hour first, then bigger speed first
         def score(task: Dict[str, Any]) -> Tuple[int, float]:
-            s = get_sellout_hour(df_sellout, task["park"], task["attraction"], mode)
+            s = task["sellout_hour"]
             if s is None:
                 s = 99
-            sp = factor_sellout_speed(df_factor, task["park"], task["attraction"], mode)
-            return (s, -sp)
+            return (s, -task["sellout_speed"])
 
-        candidates_sorted = sorted(candidates, key=score)
-        task = candidates_sorted[0]
+        # 先頭候補しか使わないので全ソートせず、最小の添字だけ求めて pop する
+        # （list.remove は dict の値比較で線形走査になる）
+        best_idx = min(range(len(candidates)), key=lambda i: score(candidates[i]))
+        task = candidates.pop(best_idx)
 
         ret = earliest_possible_return_min(task, now_min)
         if ret is None:
@@ -676,6 +954,7 @@ def build_schedule(
             return f"{task['attraction']}：{mode}枠が見つからず（売切れ想定）"
         task["status"] = "booked"
         task["return_min"] = ret
+        heapq.heappush(booked_heap, (ret, task["seq"], task))
 
         # right return rule
         if mode == MODE_DPA:
@@ -692,10 +971,7 @@ def build_schedule(
     def do_booked(task: Dict[str, Any], now_min: int) -> int:
         nonlocal next_dpa_buy_min, next_pp_get_min
 
-        duration = float(task.get("duration", 10.0))
-        if pd.isna(duration) or duration <= 0:
-            duration = 10.0
-        duration_min = int(round(duration))
+        duration_min = task["duration_min"]
 
         ride_start = now_min
         ride_end = add_event(
@@ -723,20 +999,17 @@ def build_schedule(
         hour = hour_from_min(now_min, open_hour)
 
         # wait minutes (CSV) + time-of-day multiplier (factor)
-        wait_min = float(task.get("wait_override_min", float("nan")))
-        if not pd.isna(wait_min):
+        wait_min = task["wait_override_min"]  # タスク生成時に float 化済み
+        if not math.isnan(wait_min):
             base_wait = wait_min
         else:
             base_wait = get_wait_minutes(df_wait, task["park"], task["attraction"], hour)
 
         mult = factor_wait_multiplier(df_factor, task["park"], task["attraction"], hour)
-        wait_total = int(round(float(base_wait) * float(mult)))
+        wait_total = int(round(base_wait * mult))
 
         # official duration (minutes)
-        duration = float(task.get("duration", 10.0))
-        if pd.isna(duration) or duration <= 0:
-            duration = 10.0
-        duration_min = int(round(duration))
+        duration_min = task["duration_min"]
 
         # IMPORTANT:
         # 「開始」は“乗車開始”として扱う（ユーザー要望）
@@ -756,15 +1029,14 @@ def build_schedule(
 
 
     def next_booked_return_min() -> Optional[int]:
-        mins = [t["return_min"] for t in tasks if t["status"] == "booked" and t["return_min"] is not None]
-        return min(mins) if mins else None
+        return booked_heap[0][0] if booked_heap else None
 
     # main loop
     while t < T_CLOSE:
         # 1) if any booked is ready -> do it
-        idx = find_booked_ready(t)
-        if idx is not None:
-            t = do_booked(tasks[idx], t)
+        ready = find_booked_ready(t)
+        if ready is not None:
+            t = do_booked(ready, t)
             continue
 
         # 2) try to book DPA/PP if rights available
@@ -779,21 +1051,22 @@ def build_schedule(
                 notes.append(booked_note2)
 
         # 3) if any newly booked is "now" return -> execute immediately
-        idx2 = find_booked_ready(t)
-        if idx2 is not None:
-            t = do_booked(tasks[idx2], t)
+        ready2 = find_booked_ready(t)
+        if ready2 is not None:
+            t = do_booked(ready2, t)
             continue
 
         # 4) do a WAIT task if exists
-        wait_tasks = [task for task in tasks if task["status"] == "todo" and task["mode"] == MODE_WAIT]
+        wait_tasks = todo_by_mode.get(MODE_WAIT, [])
         if wait_tasks:
             # pick smallest expected wait at this hour
             hour = hour_from_min(t, open_hour)
-            wait_tasks_sorted = sorted(
-                wait_tasks,
-                key=lambda x: get_wait_minutes(df_wait, x["park"], x["attraction"], hour),
+            picked_idx = min(
+                range(len(wait_tasks)),
+                key=lambda i: get_wait_minutes(df_wait, wait_tasks[i]["park"], wait_tasks[i]["attraction"], hour),
             )
-            t = do_wait(wait_tasks_sorted[0], t)
+            picked = wait_tasks.pop(picked_idx)
+            t = do_wait(picked, t)
             continue
 
         # 5) nothing to do now -> jump to next booked return time, else finish
@@ -803,14 +1076,15 @@ def build_schedule(
         if nb > t:
             # idle block
             timeline.append(
-                {
-                    "開始": minutes_to_hhmm(t, open_hour),
-                    "終了": minutes_to_hhmm(min(nb, T_CLOSE), open_hour),
-                    "パーク": "",
-                    "アトラクション": "（待機）",
-                    "手段": "",
-                    "メモ": "次の確保枠まで待機",
-                }
+                (
+                    "",
+                    minutes_to_hhmm(t, open_hour),
+                    minutes_to_hhmm(min(nb, T_CLOSE), open_hour),
+                    "",
+                    "（待機）",
+                    "",
+                    "次の確保枠まで待機",
+                )
             )
             t = nb
             continue
@@ -818,135 +1092,142 @@ def build_schedule(
         # safety
         t += 5
 
-    df = pd.DataFrame(timeline)
-    if df.empty:
-        df = pd.DataFrame(columns=["列開始", "開始", "終了", "パーク", "アトラクション", "手段", "メモ"])
+    df = pd.DataFrame(timeline, columns=_TIMELINE_COLUMNS)
     return df, notes
 
 
-# =========================
-# Main
-# =========================
-def main():
-    st.set_page_config(page_title=APP_TITLE, layout="wide")
+def _plans_cache_key(plans: List[Dict[str, Any]]) -> Tuple:
+    """plans をハッシュ可能なタプルに（_cached_build_schedule のキー用）"""
+    return tuple(
+        (p["park"], p["attraction"], p["mode"], p.get("duration"), p.get("wait_override_min"))
+        for p in plans
+    )
 
-    if not login_gate():
-        st.title(APP_TITLE)
-        st.info("メンバー限定機能です。合言葉を入力してください。")
-        return
 
-    _ensure_state()
+@st.cache_data(show_spinner=False, max_entries=32)
+def _cached_build_schedule(
+    plans_key: Tuple,
+    frames_key: Tuple[int, int, int],
+    crowd_stars: int,
+    interval_min: int,
+    open_hour: int,
+    close_hour: int,
+    _plans: List[Dict[str, Any]],
+    _df_wait: pd.DataFrame,
+    _df_sellout: pd.DataFrame,
+    _df_factor: pd.DataFrame,
+) -> Tuple[pd.DataFrame, List[str]]:
+    """無関係なウィジェット操作の再実行ではスケジュールを組み直さない。
+    フレーム本体（_付き）はハッシュ対象外：ローダーが返す共有シングルトンなので
+    frames_key の id で世代を代表させる。plans は plans_key で値比較する。"""
+    return build_schedule(
+        plans=_plans,
+        df_wait=_df_wait,
+        df_sellout=_df_sellout,
+        df_factor=_df_factor,
+        crowd_stars=crowd_stars,
+        interval_min=interval_min,
+        open_hour=open_hour,
+        close_hour=close_hour,
+    )
 
-    # points table init (needed early for download_button etc.)
-    if "df_points" not in st.session_state:
-        st.session_state["df_points"] = load_default_attractions_points().copy()
 
-    st.title(APP_TITLE)
-    render_about()
+@functools.lru_cache(maxsize=32)
+def _make_copy_text(crowd_period: str, wait_tol: str, happy: bool, total_points: float, limit: float, label: str, message: str) -> str:
+    """評価文（コピペ用）。入力が変わらない再実行では整形し直さない。"""
+    return (
+        f"条件：{crowd_period} / 待ち許容={wait_tol}"
+        + (" / ハッピーエントリーあり" if happy else "")
+        + f"\n合計点：{total_points:.1f}点（目安上限 {limit:.1f}点）"
+        + f"\n評価：{label}\n{message}"
+    )
 
-    # dataset selector (ID)
-    with st.sidebar:
-        st.markdown("---")
-        st.markdown("## 🗂 データセット")
-        dataset_id = st.text_input("データセットID", value="2026-02-star1", help="例：2026-02-star1（wait/sellout/factor のファイル名に使います）")
 
-    # load dataset CSVs (minutes + sellout + factor)
-    df_wait = load_wait_table_minutes(dataset_id)
-    df_sellout = load_sellout_table(dataset_id)
-    df_factor = load_factor_table(dataset_id)
+@st.fragment
+def render_left_panel(df_points_now: pd.DataFrame, df_wait: pd.DataFrame, df_sellout: pd.DataFrame, df_factor: pd.DataFrame):
+    """左カラム（条件・評価・計画）。
+    fragment化して、ここのウィジェット変更では右カラム（点数表）や about を再実行しない。
+    """
+    st.markdown("## 条件（補正）")
 
-    col_left, col_right = st.columns([1.0, 1.4], gap="large")
+    crowd_period = st.selectbox("混雑（時期の目安）", CROWD_PERIOD_OPTIONS, index=0)
+    crowd_stars = CROWD_STARS_BY_PERIOD.get(crowd_period, 2)
 
-    # =========================
-    # LEFT: conditions + evaluation + plan UI
-    # =========================
-    with col_left:
-        st.markdown("## 条件（補正）")
+    wait_tol = st.selectbox("待ち許容", ["30分まで", "60分まで", "90分まで"], index=1)
+    happy = st.checkbox("ハッピーエントリーあり（宿泊）", value=False)
 
-        crowd_period = st.selectbox("混雑（時期の目安）", CROWD_PERIOD_OPTIONS, index=0)
-        crowd_stars = CROWD_STARS_BY_PERIOD.get(crowd_period, 2)
+    st.markdown("---")
+    st.markdown("## 計画（シミュレーション）")
 
-        wait_tol = st.selectbox("待ち許容", ["30分まで", "60分まで", "90分まで"], index=1)
-        happy = st.checkbox("ハッピーエントリーあり（宿泊）", value=False)
+    interval_min = st.selectbox("インターバル（移動/休憩の目安）", [0, 5, 10, 15, 20, 30], index=2)
+    st.caption("※待ち時間CSV（分）＋係数＋公式所要時間（duration）＋インターバルで、タイムラインを組みます。")
 
-        st.markdown("---")
-        st.markdown("## 計画（シミュレーション）")
-
-        interval_min = st.selectbox("インターバル（移動/休憩の目安）", [0, 5, 10, 15, 20, 30], index=2)
-        st.caption("※待ち時間CSV（分）＋係数＋公式所要時間（duration）＋インターバルで、タイムラインを組みます。")
-
-        # compute points total from selection (points still used for your evaluation logic)
-        df_points_now = st.session_state["df_points"].copy()
-        for c in ["wait", "dpa", "pp", "duration"]:
-            if c not in df_points_now.columns:
-                df_points_now[c] = pd.NA
-        df_points_now["wait"] = pd.to_numeric(df_points_now["wait"], errors="coerce").fillna(0.0)
-        df_points_now["dpa"] = pd.to_numeric(df_points_now["dpa"], errors="coerce")
-        df_points_now["pp"] = pd.to_numeric(df_points_now["pp"], errors="coerce")
-        df_points_now["duration"] = pd.to_numeric(df_points_now.get("duration", pd.NA), errors="coerce")
-        df_points_now["duration"] = pd.to_numeric(df_points_now["duration"], errors="coerce")
-
-        plans = selected_to_plans(df_points_now, st.session_state["selected"])
-
-        # points total (simple sum by chosen mode)
-        total_points = 0.0
-        chosen_rows_points = []
-        for p in plans:
-            mode = p["mode"]
-            point = 0.0
-            if mode == MODE_WAIT:
-                point = float(p["points_wait"] or 0.0)
-            elif mode == MODE_DPA:
-                point = float(p["points_dpa"] or 0.0)
-            elif mode == MODE_PP:
-                point = float(p["points_pp"] or 0.0)
-            total_points += point
-            chosen_rows_points.append({"パーク": p["park"], "アトラクション": p["attraction"], "選択": mode, "点": point})
+    plans = selected_to_plans(df_points_now, st.session_state["selected"], sig=st.session_state.get("df_points_sig"))
 
+    # points total (simple sum by chosen mode)
+    total_points = 0.0
+    chosen_rows_points = []
+    for p in plans:
+        mode = p["mode"]
+        # `v or 0.0` は NaN を素通しする（NaNは真扱い）ので notna で判定する
+        v = p.get(_MODE_POINT_KEYS.get(mode, "points_wait"))
+        point = float(v) if v is not None and pd.notna(v) else 0.0
+        total_points += point
+        chosen_rows_points.append({"パーク": p["park"], "アトラクション": p["attraction"], "選択": mode, "点": point})
+
+    limit = _LIMIT_TABLE.get((crowd_stars, wait_tol, happy))
+    if limit is None:
+        # 想定外の組合せ（星0など）は従来の係数チェーンで計算
         limit = (
             crowd_limit_30min_from_stars(crowd_stars)
             * wait_tolerance_factor(wait_tol)
             * perk_modifier(happy)
         )
-        ev = evaluate(total_points, limit)
-
-        # big metrics
-        m1, m2 = st.columns(2)
-        with m1:
-            st.metric("合計点", f"{total_points:.1f} 点")
-        with m2:
-            st.metric("目安上限", f"{ev['limit']:.1f} 点")
-
-        b1, b2 = st.columns(2)
-        with b1:
-            if st.button("決定（評価文を表示）", key="btn_confirm_left"):
-                st.session_state["confirmed"] = True
-        with b2:
-            if st.button("選択全解除（点数表）", key="btn_clear_left"):
-                clear_all_selections()
-
-        st.markdown("---")
-
-        if st.session_state.get("confirmed", False):
-            st.markdown(f"### 評価：{ev['label']}")
-            st.write(ev["message"])
-        else:
-            st.info("「決定」を押すと、評価とコピペ用文章が表示されます。")
+    ev = evaluate(total_points, limit)
+
+    # big metrics
+    m1, m2 = st.columns(2)
+    with m1:
+        st.metric("合計点", f"{total_points:.1f} 点")
+    with m2:
+        st.metric("目安上限", f"{ev['limit']:.1f} 点")
+
+    b1, b2 = st.columns(2)
+    with b1:
+        if st.button("決定（評価文を表示）", key="btn_confirm_left"):
+            st.session_state["confirmed"] = True
+    with b2:
+        if st.button("選択全解除（点数表）", key="btn_clear_left"):
+            clear_all_selections()
+            # fragment内からの解除は右カラム（点数表）にも反映が要るので全体を再実行
+            st.rerun(scope="app")
+
+    st.markdown("---")
+
+    if st.session_state.get("confirmed", False):
+        # markdown+write を分けると protobuf 要素が2つになるので1回で出す
+        st.markdown(f"### 評価：{ev['label']}\n\n{ev['message']}")
+    else:
+        st.info("「決定」を押すと、評価とコピペ用文章が表示されます。")
 
-        st.markdown("---")
-        st.markdown("### 選択内容")
-        if chosen_rows_points:
-            df_sel = pd.DataFrame(chosen_rows_points).sort_values(["パーク", "点"], ascending=[True, False])
-            st.dataframe(df_sel, height=220, hide_index=True, use_container_width=True)
-        else:
-            st.caption("まだ何も選択されていません。")
-
-        # ---- Plan generation ----
-        
-        # ---- Plan editor (editable like points table) ----
-        if plans:
-            st.markdown("#### 計画の編集（順番/上書き）")
-            base_plan_df = pd.DataFrame(
+    st.markdown("---")
+    st.markdown("### 選択内容")
+    if chosen_rows_points:
+        df_sel = pd.DataFrame(chosen_rows_points).sort_values(["パーク", "点"], ascending=[True, False])
+        st.dataframe(df_sel, height=220, hide_index=True, use_container_width=True)
+    else:
+        st.caption("まだ何も選択されていません。")
+
+    # ---- Plan generation ----
+    
+    # ---- Plan editor (editable like points table) ----
+    if plans:
+        st.markdown("#### 計画の編集（順番/上書き）")
+        # reset editor if selection changed
+        # （base の DataFrame は選択が変わったときだけ組み直す）
+        sig = "|".join([f"{p['park']}::{p['attraction']}::{p['mode']}" for p in plans])
+        if st.session_state.get("plan_editor_sig") != sig or "plan_editor_df" not in st.session_state:
+            st.session_state["plan_editor_df"] = pd.DataFrame(
                 [
                     {
                         "順番": i + 1,
@@ -959,114 +1240,225 @@ def main():
                     for i, p in enumerate(plans)
                 ]
             )
-            # reset editor if selection changed
-            sig = "|".join([f"{p['park']}::{p['attraction']}::{p['mode']}" for p in plans])
-            if st.session_state.get("plan_editor_sig") != sig:
-                st.session_state["plan_editor_df"] = base_plan_df
-                st.session_state["plan_editor_sig"] = sig
-            else:
-                st.session_state.setdefault("plan_editor_df", base_plan_df)
-
-
-            with st.expander("（編集）計画を編集する", expanded=False):
-                edited_plan = st.data_editor(
-                    st.session_state["plan_editor_df"],
-                    key="plan_editor",
-                    use_container_width=True,
-                    hide_index=True,
-                    column_config={
-                        "順番": st.column_config.NumberColumn("順番", min_value=1, step=1),
-                        "パーク": st.column_config.TextColumn("パーク", disabled=True),
-                        "アトラクション": st.column_config.TextColumn("アトラクション", disabled=True),
-                        "手段": st.column_config.SelectboxColumn("手段", options=[MODE_WAIT, MODE_DPA, MODE_PP]),
-                        "所要(分)": st.column_config.NumberColumn("所要(分)", min_value=1, step=1),
-                        "待ち上書き(分/任意)": st.column_config.NumberColumn("待ち上書き(分/任意)", min_value=0, step=5),
-                    },
-                )
-                st.session_state["plan_editor_df"] = edited_plan
+            st.session_state["plan_editor_sig"] = sig
 
-            # apply edits back to plans (order/mode/overrides)
-            ed = st.session_state["plan_editor_df"].copy()
-            ed["順番"] = pd.to_numeric(ed["順番"], errors="coerce").fillna(9999).astype(int)
-            ed = ed.sort_values("順番").reset_index(drop=True)
+        with st.expander("（編集）計画を編集する", expanded=False):
+            edited_plan = st.data_editor(
+                st.session_state["plan_editor_df"],
+                key="plan_editor",
+                use_container_width=True,
+                hide_index=True,
+                column_config={
+                    "順番": st.column_config.NumberColumn("順番", min_value=1, step=1),
+                    "パーク": st.column_config.TextColumn("パーク", disabled=True),
+                    "アトラクション": st.column_config.TextColumn("アトラクション", disabled=True),
+                    "手段": st.column_config.SelectboxColumn("手段", options=[MODE_WAIT, MODE_DPA, MODE_PP]),
+                    "所要(分)": st.column_config.NumberColumn("所要(分)", min_value=1, step=1),
+                    "待ち上書き(分/任意)": st.column_config.NumberColumn("待ち上書き(分/任意)", min_value=0, step=5),
+                },
+            )
+            st.session_state["plan_editor_df"] = edited_plan
 
-            # rebuild plans list in edited order
-            plans_edited = []
-            for _, rr in ed.iterrows():
-                plans_edited.append(
-                    {
-                        "park": rr["パーク"],
-                        "attraction": rr["アトラクション"],
-                        "mode": rr["手段"],
-                        "duration": float(rr["所要(分)"]) if pd.notna(rr["所要(分)"]) else 10.0,
-                        "wait_override_min": float(rr["待ち上書き(分/任意)"]) if pd.notna(rr["待ち上書き(分/任意)"]) else float("nan"),
-                    }
-                )
-            plans = plans_edited
+        # apply edits back to plans (order/mode/overrides)
+        ed = st.session_state["plan_editor_df"].copy()
+        ed["順番"] = pd.to_numeric(ed["順番"], errors="coerce").fillna(9999).astype(int)
+        ed = ed.sort_values("順番").reset_index(drop=True)
 
-        st.markdown("---")
-        gen1, gen2 = st.columns([0.6, 0.4])
-        with gen1:
-            if st.button("🗓 計画を作る（時間割を提示）", key="btn_make_plan"):
-                st.session_state["plan_confirmed"] = True
-        with gen2:
-            if st.button("計画を非表示", key="btn_hide_plan"):
-                st.session_state["plan_confirmed"] = False
-
-        if st.session_state.get("plan_confirmed", False):
-            st.caption(f"インターバル: {interval_min}分")
-
-            df_plan, notes = build_schedule(
-                plans=plans,
-                df_wait=df_wait,
-                df_sellout=df_sellout,
-                df_factor=df_factor,
-                crowd_stars=crowd_stars,
-                interval_min=interval_min,
-                open_hour=9,
-                close_hour=21,
+        # rebuild plans list in edited order
+        # （iterrows は1行ごとに pd.Series を作るので、列の zip で回す）
+        plans_edited = [
+            {
+                "park": park,
+                "attraction": name,
+                "mode": mode,
+                "duration": float(dur) if pd.notna(dur) else 10.0,
+                "wait_override_min": float(ov) if pd.notna(ov) else float("nan"),
+            }
+            for park, name, mode, dur, ov in zip(
+                ed["パーク"], ed["アトラクション"], ed["手段"], ed["所要(分)"], ed["待ち上書き(分/任意)"]
             )
+        ]
+        plans = plans_edited
+
+    st.markdown("---")
+    gen1, gen2 = st.columns([0.6, 0.4])
+    with gen1:
+        if st.button("🗓 計画を作る（時間割を提示）", key="btn_make_plan"):
+            st.session_state["plan_confirmed"] = True
+    with gen2:
+        if st.button("計画を非表示", key="btn_hide_plan"):
+            st.session_state["plan_confirmed"] = False
+
+    if st.session_state.get("plan_confirmed", False):
+        st.caption(f"インターバル: {interval_min}分")
+
+        df_plan, notes = _cached_build_schedule(
+            _plans_cache_key(plans),
+            (id(df_wait), id(df_sellout), id(df_factor)),
+            crowd_stars,
+            interval_min,
+            9,
+            21,
+            plans,
+            df_wait,
+            df_sellout,
+            df_factor,
+        )
 
-            st.markdown("### アトラクション計画（時間割）")
-            st.dataframe(df_plan, use_container_width=True, hide_index=True, height=420)
-
-            with st.expander("（参考）確保ログ / 注意点", expanded=False):
-                if notes:
-                    for n in notes:
-                        st.write("・" + n)
-                else:
-                    st.write("（ログはありません）")
-
-            # copy text (updates every rerun; only shown after confirmed)
-            st.markdown("### 評価文（コピペ用）")
-            if st.session_state.get("confirmed", False):
-                copy_text = (
-                    f"条件：{crowd_period} / 待ち許容={wait_tol}"
-                    + (" / ハッピーエントリーあり" if happy else "")
-                    + f"\n合計点：{total_points:.1f}点（目安上限 {ev['limit']:.1f}点）"
-                    + f"\n評価：{ev['label']}\n{ev['message']}"
-                )
-                st.text_area(" ", value=copy_text, height=140)
+        st.markdown("### アトラクション計画（時間割）")
+        st.dataframe(df_plan, use_container_width=True, hide_index=True, height=420)
+
+        with st.expander("（参考）確保ログ / 注意点", expanded=False):
+            if notes:
+                for n in notes:
+                    st.write("・" + n)
             else:
-                st.info("「決定」を押すと、ここに評価文が出ます。")
+                st.write("（ログはありません）")
 
+    # copy text（計画の表示/非表示によらず同じ内容なので分岐の外で1回だけ描画）
+    st.markdown("### 評価文（コピペ用）")
+    if st.session_state.get("confirmed", False):
+        copy_text = _make_copy_text(crowd_period, wait_tol, happy, total_points, ev["limit"], ev["label"], ev["message"])
+        st.text_area(" ", value=copy_text, height=140)
+    else:
+        st.info("「決定」を押すと、ここに評価文が出ます。")
+
+
+# =========================
+# Main
+# =========================
+@st.fragment
+def render_points_table(df_points_now: pd.DataFrame):
+    """RIGHT: パーク絞り込み＋選択用 data_editor＋点数編集。
+    fragment なので絞り込みや編集操作では左カラムを再実行しない。
+    選択・点数の確定時だけ st.rerun(scope="app") で全体を更新する。"""
+    # Park filter
+    fcol1, fcol2 = st.columns([0.45, 0.55])
+    with fcol1:
+        park_filter = st.selectbox("パーク絞り込み", ["ALL", "TDLのみ", "TDSのみ"], index=0)
+        st.session_state["park_filter"] = park_filter
+
+    # base df: LEFTで組んだ正規化済みフレームを使い回す（マッチング用の _ 列は表示しない）
+    df_points = df_points_now.drop(columns=["_park_norm", "_attr_norm"], errors="ignore")
+
+    # view filter（パーク別の行位置は sig ごとに1回だけ計算して take で切り出す）
+    target_park = {"TDLのみ": "TDL", "TDSのみ": "TDS"}.get(park_filter)
+    if target_park is None:
+        df_view = df_points.copy(deep=False)
+    else:
+        pos = _park_row_positions(st.session_state.get("df_points_sig", 0), df_points).get(target_park, [])
+        df_view = df_points.take(pos)
+    df_view = df_view.reset_index(drop=True)
+
+    st.caption("「選択」列で手段を選ぶと採用されます（採用しない＝未選択）")
+
+    # 1行ごとの st.columns + button はウィジェット数が 4×N に膨らみ再実行が重くなるため、
+    # data_editor 1個（SelectboxColumn）に集約する
+    row_keys = _view_row_keys(st.session_state.get("df_points_sig", 0), park_filter, df_view)
+    sel = st.session_state["selected"]
+    df_view.insert(0, "選択", [sel.get(k, MODE_NONE) for k in row_keys])
+    picked = st.data_editor(
+        df_view.rename(
+            columns={"park": "パーク", "attraction": "アトラクション", "wait": "並ぶ（点）", "dpa": "DPA（点）", "pp": "PP（点）", "duration": "所要（分）"}
+        ),
+        key=f"picker_{park_filter}",
+        use_container_width=True,
+        height=520,
+        hide_index=True,
+        disabled=["パーク", "アトラクション", "並ぶ（点）", "DPA（点）", "PP（点）", "所要（分）"],
+        column_config={
+            "選択": st.column_config.SelectboxColumn("選択", options=[MODE_NONE, MODE_WAIT, MODE_DPA, MODE_PP], width="small"),
+            "パーク": st.column_config.TextColumn("パーク", width="small"),
+            "アトラクション": st.column_config.TextColumn("アトラクション", width="large"),
+        },
+    )
+
+    # write back choices (filter外の行の選択は保持)
+    new_selected = dict(st.session_state["selected"])
+    for park, name, choice in zip(picked["パーク"], picked["アトラクション"], picked["選択"]):
+        row_key = _row_id(str(park).strip(), str(name).strip())
+        if choice == MODE_NONE or pd.isna(choice):
+            new_selected.pop(row_key, None)
         else:
-            # copy section even if plan hidden
-            st.markdown("### 評価文（コピペ用）")
-            if st.session_state.get("confirmed", False):
-                copy_text = (
-                    f"条件：{crowd_period} / 待ち許容={wait_tol}"
-                    + (" / ハッピーエントリーあり" if happy else "")
-                    + f"\n合計点：{total_points:.1f}点（目安上限 {ev['limit']:.1f}点）"
-                    + f"\n評価：{ev['label']}\n{ev['message']}"
-                )
-                st.text_area(" ", value=copy_text, height=140)
-            else:
-                st.info("「決定」を押すと、ここに評価文が出ます。")
+            new_selected[row_key] = choice
+    if new_selected != st.session_state["selected"]:
+        st.session_state["selected"] = new_selected
+        st.rerun(scope="app")  # 左カラムの評価も更新する
+
+    with st.expander("（任意）点数表を編集する（並ぶ/DPA/PP）", expanded=False):
+        df_edit = df_points.rename(
+            columns={"park": "パーク", "attraction": "アトラクション", "wait": "並ぶ（点）", "dpa": "DPA（点）", "pp": "PP（点）", "duration": "所要（分）"}
+        )
+        edited = st.data_editor(
+            df_edit,
+            key="points_editor_edit",
+            use_container_width=True,
+            height=420,
+            hide_index=True,
+            column_config={
+                "パーク": st.column_config.SelectboxColumn("パーク", options=["TDL", "TDS"], width="small"),
+                "アトラクション": st.column_config.TextColumn("アトラクション", width="large"),
+                "並ぶ（点）": st.column_config.NumberColumn("並ぶ（点）", min_value=0.0, step=1.0, width="small"),
+                "DPA（点）": st.column_config.NumberColumn("DPA（点）", width="small"),
+                "PP（点）": st.column_config.NumberColumn("PP（点）", width="small"),
+                "所要（分）": st.column_config.NumberColumn("所要（分）", min_value=0.0, step=1.0, width="small"),
+            },
+        )
+        back = edited.rename(
+            columns={"パーク": "park", "アトラクション": "attraction", "並ぶ（点）": "wait", "DPA（点）": "dpa", "PP（点）": "pp", "所要（分）": "duration"}
+        )
+        back["wait"] = pd.to_numeric(back["wait"], errors="coerce").fillna(0.0)
+        back["dpa"] = pd.to_numeric(back["dpa"], errors="coerce")
+        back["pp"] = pd.to_numeric(back["pp"], errors="coerce")
+        back["duration"] = pd.to_numeric(back.get("duration", pd.NA), errors="coerce")
+
+        back_sig = points_sig(back)
+        if back_sig != st.session_state.get("df_points_sig"):
+            st.session_state["df_points"] = back
+            st.session_state["df_points_sig"] = back_sig
+            st.success("点数表を更新しました（選択状態は保持されます）。")
+            st.rerun(scope="app")  # 編集反映は即がよい（左カラム含め全体を更新）
+
+
+def main():
+    st.set_page_config(page_title=APP_TITLE, layout="wide")
+
+    if not login_gate():
+        st.title(APP_TITLE)
+        st.info("メンバー限定機能です。合言葉を入力してください。")
+        return
+
+    _ensure_heavy_imports()
+    _ensure_state()
+
+    # points table init (needed early for download_button etc.)
+    if "df_points" not in st.session_state:
+        # ローダーは共有シングルトンを返すので、セッションで編集する分はここで切り離す
+        st.session_state["df_points"] = load_default_attractions_points().copy()
+        st.session_state["df_points_sig"] = points_sig(st.session_state["df_points"])
 
-        # =========================
-        # RIGHT: points table
-        # =========================
+    st.title(APP_TITLE)
+    render_about()
+
+    # dataset selector (ID)
+    with st.sidebar:
+        st.markdown("---")
+        st.markdown("## 🗂 データセット")
+        dataset_id = st.text_input("データセットID", value="2026-02-star1", help="例：2026-02-star1（wait/sellout/factor のファイル名に使います）")
+
+    # load dataset CSVs (minutes + sellout + factor)
+    df_wait = load_wait_table_minutes(dataset_id)
+    df_sellout = load_sellout_table(dataset_id)
+    df_factor = load_factor_table(dataset_id)
+
+    col_left, col_right = st.columns([1.0, 1.4], gap="large")
+
+    # =========================
+    # RIGHT (先行分): CSV IO
+    # =========================
+    # アップロードは df_points を差し替えるので、正規化フレームを組む前に処理して
+    # 同一実行内で下のウィジェット群に反映させる（st.rerun() 1回分を節約）。
+    # カラムコンテナは実行順ではなく配置順に描画されるため、ここだけ先に入ってよい。
     with col_right:
         st.markdown("## 点数表（選ぶ）")
         st.caption("一覧はスクロールできます。点数もこの画面上で編集できます（自分用カスタム）。")
@@ -1075,7 +1467,12 @@ def main():
         with st.expander("（任意）点数表CSVの読み込み/書き出し", expanded=False):
             up = st.file_uploader("attractions_master.csv をアップロード（上書き）", type=["csv"])
             if up is not None:
-                df_up = pd.read_csv(up)
+                # ローダーと同じく pyarrow エンジン優先（無い環境では標準エンジンに戻す）
+                try:
+                    df_up = pd.read_csv(up, engine="pyarrow")
+                except (ImportError, ValueError):
+                    up.seek(0)
+                    df_up = pd.read_csv(up)
                 for c in ["wait", "dpa", "pp", "duration"]:
                     if c in df_up.columns:
                         df_up[c] = pd.to_numeric(df_up[c], errors="coerce")
@@ -1083,141 +1480,41 @@ def main():
                     df_up["pp"] = pd.NA
                 if "duration" not in df_up.columns:
                     df_up["duration"] = pd.NA
-                if "duration" not in df_up.columns:
-                    df_up["duration"] = pd.NA
                 if "park" in df_up.columns:
                     df_up["park"] = df_up["park"].astype(str).str.strip()
                 if "attraction" in df_up.columns:
                     df_up["attraction"] = df_up["attraction"].astype(str).str.strip()
                 if "park" in df_up.columns and "attraction" in df_up.columns:
-                    df_up = df_up.drop_duplicates(subset=["park", "attraction"], keep="first").reset_index(drop=True)
+                    # ローダーと同じ duplicated() マスク方式（重複なしならマスクだけで済む）
+                    dup = df_up.duplicated(subset=["park", "attraction"], keep="first")
+                    if dup.any():
+                        df_up = df_up[~dup].reset_index(drop=True)
 
                 st.session_state["df_points"] = df_up
+                st.session_state["df_points_sig"] = points_sig(df_up)
                 st.success("点数表を読み込みました。")
-                st.rerun()  # ここは反映優先
 
             st.download_button(
                 "現在の点数表をCSVでダウンロード",
-                st.session_state["df_points"].to_csv(index=False).encode("utf-8-sig"),
+                _points_csv_bytes(st.session_state.get("df_points_sig", 0), st.session_state["df_points"]),
                 file_name="attractions_master.csv",
                 mime="text/csv",
             )
 
-        # Park filter
-        fcol1, fcol2 = st.columns([0.45, 0.55])
-        with fcol1:
-            park_filter = st.selectbox("パーク絞り込み", ["ALL", "TDLのみ", "TDSのみ"], index=0)
-            st.session_state["park_filter"] = park_filter
-
-        # base df
-        df_points = st.session_state["df_points"].copy()
-        for c in ["wait", "dpa", "pp", "duration"]:
-            if c not in df_points.columns:
-                df_points[c] = pd.NA
-
-        df_points["wait"] = pd.to_numeric(df_points["wait"], errors="coerce").fillna(0.0)
-        df_points["dpa"] = pd.to_numeric(df_points["dpa"], errors="coerce")
-        df_points["pp"] = pd.to_numeric(df_points["pp"], errors="coerce")
-        df_points["duration"] = pd.to_numeric(df_points["duration"], errors="coerce")
-
-        # view filter
-        df_view = df_points.copy()
-        if park_filter == "TDLのみ":
-            df_view = df_view[df_view["park"] == "TDL"]
-        elif park_filter == "TDSのみ":
-            df_view = df_view[df_view["park"] == "TDS"]
-        df_view = df_view.reset_index(drop=True)
-
-        # header
-        h1, h2, h3, h4, h5 = st.columns([0.12, 0.55, 0.11, 0.11, 0.11])
-        h1.markdown("**パーク**")
-        h2.markdown("**アトラクション**")
-        h3.markdown("**並ぶ（点）**")
-        h4.markdown("**DPA（点）**")
-        h5.markdown("**PP（点）**")
-
-        st.caption("点数セルを押して選択（同一アトラクションは排他。もう一度押すと解除）")
-
-        with st.container(height=520):
-            for _, r in df_view.iterrows():
-                park = str(r.get("park", "")).strip()
-                name = str(r.get("attraction", "")).strip()
-                row_key = _row_id(park, name)
-
-                wait_p = float(r["wait"]) if pd.notna(r["wait"]) else 0.0
-                dpa_p = r["dpa"]
-                pp_p = r["pp"]
-
-                selected_mode = st.session_state["selected"].get(row_key)
-
-                c1, c2, c3, c4, c5 = st.columns([0.12, 0.55, 0.11, 0.11, 0.11], vertical_alignment="center")
-                c1.write(park)
-                c2.write(name)
-
-                c3.button(
-                    f"{wait_p:.0f}" if wait_p == int(wait_p) else f"{wait_p}",
-                    key=f"btn_wait__{row_key}",
-                    on_click=toggle_select,
-                    args=(row_key, MODE_WAIT),
-                    type=("primary" if selected_mode == MODE_WAIT else "secondary"),
-                    disabled=(wait_p <= 0),
-                    use_container_width=True,
-                )
-
-                c4.button(
-                    ("—" if pd.isna(dpa_p) else f"{float(dpa_p):.0f}"),
-                    key=f"btn_dpa__{row_key}",
-                    on_click=toggle_select,
-                    args=(row_key, MODE_DPA),
-                    type=("primary" if selected_mode == MODE_DPA else "secondary"),
-                    disabled=pd.isna(dpa_p),
-                    use_container_width=True,
-                )
-
-                c5.button(
-                    ("—" if pd.isna(pp_p) else f"{float(pp_p):.0f}"),
-                    key=f"btn_pp__{row_key}",
-                    on_click=toggle_select,
-                    args=(row_key, MODE_PP),
-                    type=("primary" if selected_mode == MODE_PP else "secondary"),
-                    disabled=pd.isna(pp_p),
-                    use_container_width=True,
-                )
-
-        with st.expander("（任意）点数表を編集する（並ぶ/DPA/PP）", expanded=False):
-            df_edit = df_points.rename(
-                columns={"park": "パーク", "attraction": "アトラクション", "wait": "並ぶ（点）", "dpa": "DPA（点）", "pp": "PP（点）", "duration": "所要（分）"}
-            )
-            edited = st.data_editor(
-                df_edit,
-                key="points_editor_edit",
-                use_container_width=True,
-                height=420,
-                hide_index=True,
-                column_config={
-                    "パーク": st.column_config.SelectboxColumn("パーク", options=["TDL", "TDS"], width="small"),
-                    "アトラクション": st.column_config.TextColumn("アトラクション", width="large"),
-                    "並ぶ（点）": st.column_config.NumberColumn("並ぶ（点）", min_value=0.0, step=1.0, width="small"),
-                    "DPA（点）": st.column_config.NumberColumn("DPA（点）", width="small"),
-                    "PP（点）": st.column_config.NumberColumn("PP（点）", width="small"),
-                    "所要（分）": st.column_config.NumberColumn("所要（分）", min_value=1.0, step=1.0, width="small"),
-                    "所要（分）": st.column_config.NumberColumn("所要（分）", min_value=0.0, step=1.0, width="small"),
-                },
-            )
-            back = edited.rename(
-                columns={"パーク": "park", "アトラクション": "attraction", "並ぶ（点）": "wait", "DPA（点）": "dpa", "PP（点）": "pp", "所要（分）": "duration"}
-            )
-            back["wait"] = pd.to_numeric(back["wait"], errors="coerce").fillna(0.0)
-            back["dpa"] = pd.to_numeric(back["dpa"], errors="coerce")
-            back["pp"] = pd.to_numeric(back["pp"], errors="coerce")
-            back["duration"] = pd.to_numeric(back.get("duration", pd.NA), errors="coerce")
-            back["duration"] = pd.to_numeric(back["duration"], errors="coerce")
+    # 点数表の正規化フレームはシグネチャ単位でキャッシュし、LEFT/RIGHT両カラムで共有する
+    df_points_now = _coerced_points(st.session_state.get("df_points_sig", 0), st.session_state["df_points"])
 
-            if not back.equals(st.session_state["df_points"]):
-                st.session_state["df_points"] = back
-                st.success("点数表を更新しました（選択状態は保持されます）。")
-                st.rerun()  # 編集反映は即がよい
+    # =========================
+    # LEFT: conditions + evaluation + plan UI
+    # =========================
+    with col_left:
+        render_left_panel(df_points_now, df_wait, df_sellout, df_factor)
 
+    # =========================
+    # RIGHT: points table
+    # =========================
+    with col_right:
+        render_points_table(df_points_now)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file